@@ -1,16 +1,47 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import os
 from dotenv import load_dotenv
 from services.git_analyzer import GitAnalyzer
-from services.llm_analyzer import LLMAnalyzer
+from services.llm_analyzer import LLMAnalyzer, get_token_encoder
 from services.database import Database
+from functools import lru_cache
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import asyncio
 import json
+import orjson
 
 load_dotenv()
 
-app = FastAPI(title="CodeTime Navigator API")
+# Seconds between sweeps of analyses that have not been updated within the retention window
+CLEANUP_INTERVAL = 3600
+
+async def cleanup_periodically():
+    """Purge stale analyses for as long as the app is running"""
+    while True:
+        try:
+            await asyncio.to_thread(db.cleanup_old_analyses)
+        except Exception as e:
+            print(f"Error cleaning up old analyses: {e}")
+        await asyncio.sleep(CLEANUP_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    cleanup = asyncio.create_task(cleanup_periodically())
+    # Load the tokenizer in the background so the first query does not wait for it
+    asyncio.get_running_loop().run_in_executor(None, get_token_encoder)
+    try:
+        yield
+    finally:
+        cleanup.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(title="CodeTime Navigator API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,8 +52,38 @@ app.add_middleware(
 )
 
 git_analyzer = GitAnalyzer()
-llm_analyzer = LLMAnalyzer()
 db = Database()
+llm_analyzer = LLMAnalyzer(db)
+
+def new_executor() -> ProcessPoolExecutor:
+    """Process pool for analyses; workers are spawned, not forked, so each opens its own SQLite connection and API clients"""
+    return ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+# Analyses run in worker processes so cloning and parsing never block request handling
+executor = new_executor()
+
+def replace_broken_executor(broken: ProcessPoolExecutor):
+    """Swap in a fresh pool once a worker death has broken the current one for good"""
+    global executor
+    if executor is broken:
+        executor = new_executor()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+def submit_analysis(repo_id: str, repo_url: str, max_commits: int) -> asyncio.Future:
+    """Run an analysis in the process pool, replacing the pool first if it is broken"""
+    loop = asyncio.get_running_loop()
+    pool = executor
+    try:
+        future = loop.run_in_executor(pool, run_analysis, repo_id, repo_url, max_commits)
+    except BrokenProcessPool:
+        replace_broken_executor(pool)
+        pool = executor
+        future = loop.run_in_executor(pool, run_analysis, repo_id, repo_url, max_commits)
+    future.add_done_callback(lambda f: mark_worker_failure(repo_id, f, pool))
+    return future
 
 class AnalyzeRequest(BaseModel):
     repo_url: str
@@ -37,22 +98,24 @@ async def root():
     return {"message": "CodeTime Navigator API"}
 
 @app.post("/analyze")
-async def analyze_repository(request: AnalyzeRequest, background_tasks: BackgroundTasks):
+async def analyze_repository(request: AnalyzeRequest):
     try:
         repo_id = git_analyzer.get_repo_id(request.repo_url)
         
-        # Check if already analyzed
-        existing_analysis = db.get_analysis(repo_id)
-        if existing_analysis:
-            return {"repo_id": repo_id, "status": "completed", "cached": True}
-        
-        # Start background analysis
-        background_tasks.add_task(
-            analyze_repo_background, 
-            repo_id, 
-            request.repo_url, 
-            request.max_commits
-        )
+        # Check if already analyzed or in progress; failed analyses are retried
+        existing_analysis = await asyncio.to_thread(db.get_status, repo_id)
+        if existing_analysis and existing_analysis["status"] != "failed":
+            return {"repo_id": repo_id, "status": existing_analysis["status"], "cached": True}
+        
+        # Mark as processing before handing off, so status polls never race the worker
+        await asyncio.to_thread(db.update_analysis_status, repo_id, "processing")
+        
+        # Start background analysis in the process pool
+        try:
+            submit_analysis(repo_id, request.repo_url, request.max_commits)
+        except Exception as e:
+            await asyncio.to_thread(db.update_analysis_status, repo_id, "failed", str(e))
+            raise
         
         return {"repo_id": repo_id, "status": "processing", "cached": False}
     
@@ -60,16 +123,24 @@ async def analyze_repository(request: AnalyzeRequest, background_tasks: Backgrou
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/analysis/{repo_id}")
-async def get_analysis_status(repo_id: str):
-    analysis = db.get_analysis(repo_id)
-    if not analysis:
+async def get_analysis_status(repo_id: str, request: Request, response: Response):
+    status = await asyncio.to_thread(db.get_status, repo_id)
+    if not status:
         raise HTTPException(status_code=404, detail="Analysis not found")
-    return analysis
+    
+    etag = make_etag(status["updated_at"])
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    
+    if status["status"] != "completed":
+        return status
+    return await asyncio.to_thread(load_analysis, repo_id, status["updated_at"])
 
 @app.post("/query")
 async def query_repository(request: QueryRequest):
     try:
-        analysis = db.get_analysis(request.repo_id)
+        analysis = await asyncio.to_thread(db.get_analysis, request.repo_id)
         if not analysis:
             raise HTTPException(status_code=404, detail="Repository not analyzed")
         
@@ -80,7 +151,8 @@ async def query_repository(request: QueryRequest):
         result = await llm_analyzer.process_query(
             request.query,
             analysis["commits"],
-            analysis["patterns"]
+            analysis["patterns"],
+            request.repo_id
         )
         
         return {"query": request.query, "result": result}
@@ -88,30 +160,68 @@ async def query_repository(request: QueryRequest):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/query/stream")
+async def stream_query_repository(request: QueryRequest):
+    try:
+        analysis = await asyncio.to_thread(db.get_analysis, request.repo_id)
+        if not analysis:
+            raise HTTPException(status_code=404, detail="Repository not analyzed")
+        
+        if analysis["status"] != "completed":
+            raise HTTPException(status_code=400, detail="Analysis still in progress")
+        
+        # Newline-delimited JSON: answer text deltas as they arrive, then the parsed result
+        async def events():
+            async for event in llm_analyzer.stream_query(
+                request.query,
+                analysis["commits"],
+                analysis["patterns"],
+                request.repo_id
+            ):
+                yield orjson.dumps(event) + b"\n"
+        
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+    
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/visualize/{repo_id}")
-async def get_visualization_data(repo_id: str):
+async def get_visualization_data(repo_id: str, request: Request, response: Response):
     try:
-        analysis = db.get_analysis(repo_id)
+        analysis = await asyncio.to_thread(db.get_status, repo_id)
         if not analysis or analysis["status"] != "completed":
             raise HTTPException(status_code=404, detail="Analysis not found or incomplete")
         
-        # Generate visualization data
-        viz_data = {
-            "timeline": generate_timeline_data(analysis["commits"]),
-            "heatmap": generate_heatmap_data(analysis["commits"]),
-            "ownership": generate_ownership_data(analysis["commits"])
-        }
+        etag = make_etag(analysis["updated_at"])
+        if is_not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
         
-        return viz_data
+        return await asyncio.to_thread(build_visualization, repo_id, analysis["updated_at"])
     
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+def mark_worker_failure(repo_id: str, future: asyncio.Future, pool: ProcessPoolExecutor):
+    """Record analyses whose worker process died before it could report back"""
+    if not future.cancelled() and future.exception() is not None:
+        if isinstance(future.exception(), BrokenProcessPool):
+            replace_broken_executor(pool)
+        # Done-callbacks run on the event loop, so the write goes to a thread like every other DB call
+        future.get_loop().run_in_executor(None, db.update_analysis_status, repo_id, "failed", str(future.exception()))
+
+# Event loop reused by every analysis a worker process runs
+_worker_loop = None
+
+def run_analysis(repo_id: str, repo_url: str, max_commits: int):
+    """Process pool entry point: run one analysis inside a worker"""
+    global _worker_loop
+    if _worker_loop is None:
+        _worker_loop = asyncio.new_event_loop()
+    _worker_loop.run_until_complete(analyze_repo_background(repo_id, repo_url, max_commits))
+
 async def analyze_repo_background(repo_id: str, repo_url: str, max_commits: int):
     try:
-        # Update status to processing
-        db.update_analysis_status(repo_id, "processing")
-        
         # Clone and analyze repository
         repo_data = git_analyzer.analyze_repository(repo_url, max_commits)
         
@@ -129,11 +239,57 @@ async def analyze_repo_background(repo_id: str, repo_url: str, max_commits: int)
             "stats": repo_data["stats"]
         }
         
-        db.store_analysis(repo_id, analysis_data)
+        # Visualizations are pure functions of the stored analysis, so build them once here,
+        # in the same transaction so the analysis never reads as completed without one
+        db.store_analysis(
+            repo_id,
+            analysis_data,
+            visualize=lambda: generate_visualization_data(repo_id, repo_data["commits"])
+        )
         
     except Exception as e:
         db.update_analysis_status(repo_id, "failed", str(e))
 
+def make_etag(updated_at: str) -> str:
+    """Weak ETag for an analysis; it changes whenever the row is rewritten"""
+    return f'W/"{updated_at}"'
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """Check the request's If-None-Match header against the current ETag"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+# Completed analyses are immutable until re-stored, so results are keyed by
+# (repo_id, updated_at) and a rewrite simply misses the cache
+@lru_cache(maxsize=32)
+def load_analysis(repo_id: str, updated_at: str):
+    """Load a completed analysis"""
+    return db.get_analysis(repo_id)
+
+def build_visualization(repo_id: str, updated_at: str):
+    """Load the visualization stored at analysis time, generating it if missing"""
+    viz_data = load_stored_visualization(repo_id, updated_at)
+    if viz_data is None:
+        # Only analyses stored before visualizations were precomputed lack one; not memoized
+        viz_data = generate_visualization_data(repo_id, db.get_commits(repo_id))
+    return viz_data
+
+@lru_cache(maxsize=128)
+def load_stored_visualization(repo_id: str, updated_at: str):
+    """Load the visualization written together with the analysis"""
+    return db.get_visualization(repo_id)
+
+def generate_visualization_data(repo_id: str, commits):
+    """Generate visualization data; file and author aggregates run in SQLite"""
+    return {
+        "timeline": generate_timeline_data(commits),
+        "heatmap": db.get_file_heatmap(repo_id),
+        "ownership": db.get_ownership(repo_id)
+    }
+
 def generate_timeline_data(commits):
     """Generate timeline visualization data"""
     timeline = []
@@ -148,42 +304,6 @@ def generate_timeline_data(commits):
             })
     return timeline
 
-def generate_heatmap_data(commits):
-    """Generate file change heatmap data"""
-    file_changes = {}
-    for commit in commits:
-        for file_path in commit["files"]:
-            if file_path not in file_changes:
-                file_changes[file_path] = 0
-            file_changes[file_path] += 1
-    
-    # Convert to heatmap format
-    heatmap = [
-        {"file": file, "changes": count}
-        for file, count in sorted(file_changes.items(), key=lambda x: x[1], reverse=True)[:50]
-    ]
-    return heatmap
-
-def generate_ownership_data(commits):
-    """Generate code ownership data"""
-    author_stats = {}
-    for commit in commits:
-        author = commit["author"]
-        if author not in author_stats:
-            author_stats[author] = {"commits": 0, "files": set()}
-        author_stats[author]["commits"] += 1
-        author_stats[author]["files"].update(commit["files"])
-    
-    ownership = [
-        {
-            "author": author,
-            "commits": stats["commits"],
-            "files_touched": len(stats["files"])
-        }
-        for author, stats in author_stats.items()
-    ]
-    return sorted(ownership, key=lambda x: x["commits"], reverse=True)
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
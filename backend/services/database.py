@@ -1,166 +1,532 @@
 import sqlite3
-import json
+import orjson
+import numpy as np
 import os
-from typing import Dict, Any, Optional, List
-from datetime import datetime
+import threading
+import time
+from itertools import chain
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Callable
+from datetime import datetime, timedelta, timezone
+
+# Bump when the table layout or repo_id scheme changes; the file is a cache, so older layouts are dropped
+SCHEMA_VERSION = 5
+
+# Upper bound on cached query answers across all repositories
+QUERY_CACHE_CAPACITY = 1000
+
+def _pack_date(date: str) -> tuple:
+    """Split an ISO 8601 commit date into a unix timestamp and a UTC offset in minutes"""
+    parsed = datetime.fromisoformat(date.replace('Z', '+00:00'))
+    offset = parsed.utcoffset()
+    return int(parsed.timestamp()), int(offset.total_seconds() // 60) if offset else 0
+
+def _now() -> int:
+    """Current time in microseconds since the epoch, fine enough to tell rewrites apart"""
+    return time.time_ns() // 1000
+
+def _format_timestamp(timestamp: int) -> str:
+    """Format a stored microsecond timestamp as local ISO 8601 for API responses"""
+    return datetime.fromtimestamp(timestamp / 1_000_000).isoformat()
+
+def _unpack_date(timestamp: int, offset: int) -> str:
+    """Format a stored commit date back into the ISO 8601 form git reported"""
+    return datetime.fromtimestamp(timestamp, timezone(timedelta(minutes=offset))).isoformat()
 
 class Database:
     def __init__(self, db_path: str = "analysis_cache.db"):
         self.db_path = db_path
+        # One long-lived connection in autocommit mode; sqlite3 connections are not
+        # safe for concurrent use, so every access goes through the lock
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
         self.init_database()
     
     def init_database(self):
         """Initialize SQLite database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create analysis table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS analyses (
-                repo_id TEXT PRIMARY KEY,
-                repo_url TEXT NOT NULL,
-                status TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL,
-                data TEXT,
-                error_message TEXT
+        with self._lock:
+            # Connection-level tuning, applied once for the lifetime of the connection
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+            self._conn.execute("PRAGMA temp_store=MEMORY")
+            self._conn.execute("PRAGMA mmap_size=268435456")  # 256 MiB
+            
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                for table in ("llm_cache", "embedding_cache", "query_cache", "visualizations", "commit_files", "commits", "analyses"):
+                    self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+                self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            
+            # Create analysis table; `data` is an orjson-encoded blob of everything except the commits
+            # and timestamps are integer microseconds since the epoch
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS analyses (
+                    repo_id TEXT PRIMARY KEY,
+                    repo_url TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at INTEGER NOT NULL,
+                    updated_at INTEGER NOT NULL,
+                    data BLOB,
+                    error_message TEXT
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analyses_updated ON analyses(updated_at)")
+            
+            # Commits and their changed files, one row each; dates are unix timestamps plus the UTC offset in minutes
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS commits (
+                    repo_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    hash TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    author TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    date INTEGER NOT NULL,
+                    tz_offset INTEGER NOT NULL,
+                    insertions INTEGER NOT NULL,
+                    deletions INTEGER NOT NULL,
+                    files_changed INTEGER NOT NULL,
+                    PRIMARY KEY (repo_id, position),
+                    UNIQUE (repo_id, hash)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS commit_files (
+                    repo_id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    path TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_commit_files_path ON commit_files(repo_id, path)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_commits_author ON commits(repo_id, author)")
+            
+            # Visualization payloads, computed once when an analysis completes
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS visualizations (
+                    repo_id TEXT PRIMARY KEY,
+                    data BLOB NOT NULL
+                )
+            """)
+            
+            # Answered queries with their unit-length float32 embeddings, for semantic lookups
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_cache (
+                    repo_id TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    result BLOB NOT NULL,
+                    hits INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    priority REAL NOT NULL,
+                    created_at INTEGER NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_query_cache_repo ON query_cache(repo_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_query_cache_priority ON query_cache(priority)")
+            
+            # Embeddings by content hash, stored as float16 to halve their size
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    vec BLOB NOT NULL,
+                    PRIMARY KEY (hash, model)
+                )
+            """)
+            
+            # Completion texts keyed by a hash of the request that produced them
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at INTEGER NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache(created_at)")
+    
+    @contextmanager
+    def _transaction(self):
+        """Run several statements atomically on the shared connection"""
+        with self._lock:
+            # Take the write lock up front so concurrent writers wait instead of failing mid-transaction
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+    
+    def close(self):
+        """Close the shared connection"""
+        with self._lock:
+            self._conn.close()
+    
+    def store_analysis(self, repo_id: str, analysis_data: Dict[str, Any], visualize: Optional[Callable[[], Dict[str, Any]]] = None):
+        """Store complete analysis results; visualize builds the visualization payload stored in the same transaction"""
+        now = _now()
+        commits = analysis_data.get("commits", [])
+        summary = {key: value for key, value in analysis_data.items() if key != "commits"}
+        
+        with self._transaction() as conn:
+            self._delete_derived_rows(conn, repo_id)
+            conn.execute("""
+                INSERT OR REPLACE INTO analyses 
+                (repo_id, repo_url, status, created_at, updated_at, data, error_message)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (
+                repo_id,
+                analysis_data["repo_url"],
+                analysis_data["status"],
+                now,
+                now,
+                orjson.dumps(summary),
+                None
+            ))
+            conn.executemany("""
+                INSERT INTO commits 
+                (repo_id, position, hash, message, author, email, date, tz_offset, insertions, deletions, files_changed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                (
+                    repo_id,
+                    position,
+                    commit["hash"],
+                    commit["message"],
+                    commit["author"],
+                    commit["email"],
+                    *_pack_date(commit["date"]),
+                    commit["stats"]["insertions"],
+                    commit["stats"]["deletions"],
+                    commit["stats"]["files_changed"]
+                )
+                for position, commit in enumerate(commits)
+            ))
+            conn.executemany(
+                "INSERT INTO commit_files (repo_id, hash, path) VALUES (?, ?, ?)",
+                chain.from_iterable(
+                    ((repo_id, commit["hash"], path) for path in commit["files"])
+                    for commit in commits
+                )
             )
-        """)
-        
-        conn.commit()
-        conn.close()
-    
-    def store_analysis(self, repo_id: str, analysis_data: Dict[str, Any]):
-        """Store complete analysis results"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        now = datetime.now().isoformat()
-        
-        cursor.execute("""
-            INSERT OR REPLACE INTO analyses 
-            (repo_id, repo_url, status, created_at, updated_at, data, error_message)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            repo_id,
-            analysis_data["repo_url"],
-            analysis_data["status"],
-            now,
-            now,
-            json.dumps(analysis_data),
-            None
-        ))
-        
-        conn.commit()
-        conn.close()
+            if visualize is not None:
+                # Runs on this connection under the held lock, so its aggregates see the rows just written,
+                # and readers never see a completed analysis without its visualization
+                self.store_visualization(repo_id, visualize())
     
     def get_analysis(self, repo_id: str) -> Optional[Dict[str, Any]]:
         """Retrieve analysis by repository ID"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT data, status, error_message, updated_at 
-            FROM analyses 
-            WHERE repo_id = ?
-        """, (repo_id,))
+        with self._lock:
+            result = self._conn.execute("""
+                SELECT data, status, error_message, updated_at 
+                FROM analyses 
+                WHERE repo_id = ?
+            """, (repo_id,)).fetchone()
+            
+            if result:
+                data, status, error_message, updated_at = result
+                if data:
+                    analysis = orjson.loads(data)
+                    analysis["commits"] = self._load_commits(repo_id)
+                    analysis["updated_at"] = _format_timestamp(updated_at)
+                    return analysis
+                else:
+                    return {
+                        "repo_id": repo_id,
+                        "status": status,
+                        "error_message": error_message,
+                        "updated_at": _format_timestamp(updated_at)
+                    }
         
-        result = cursor.fetchone()
-        conn.close()
+        return None
+    
+    def get_status(self, repo_id: str) -> Optional[Dict[str, Any]]:
+        """Retrieve only the status columns of an analysis, without loading its data"""
+        with self._lock:
+            result = self._conn.execute("""
+                SELECT status, error_message, updated_at 
+                FROM analyses 
+                WHERE repo_id = ?
+            """, (repo_id,)).fetchone()
         
         if result:
-            data, status, error_message, updated_at = result
-            if data:
-                analysis = json.loads(data)
-                analysis["updated_at"] = updated_at
-                return analysis
-            else:
-                return {
-                    "repo_id": repo_id,
-                    "status": status,
-                    "error_message": error_message,
-                    "updated_at": updated_at
-                }
+            status, error_message, updated_at = result
+            return {
+                "repo_id": repo_id,
+                "status": status,
+                "error_message": error_message,
+                "updated_at": _format_timestamp(updated_at)
+            }
         
         return None
     
-    def update_analysis_status(self, repo_id: str, status: str, error_message: str = None):
-        """Update analysis status"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_commits(self, repo_id: str) -> List[Dict[str, Any]]:
+        """Retrieve the commits of an analysis, newest first"""
+        with self._lock:
+            return self._load_commits(repo_id)
+    
+    def store_visualization(self, repo_id: str, visualization: Dict[str, Any]):
+        """Store the precomputed visualization payload of an analysis"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO visualizations (repo_id, data) VALUES (?, ?)",
+                (repo_id, orjson.dumps(visualization))
+            )
+    
+    def get_visualization(self, repo_id: str) -> Optional[Dict[str, Any]]:
+        """Retrieve the precomputed visualization payload of an analysis"""
+        with self._lock:
+            result = self._conn.execute(
+                "SELECT data FROM visualizations WHERE repo_id = ?", (repo_id,)
+            ).fetchone()
         
-        now = datetime.now().isoformat()
+        return orjson.loads(result[0]) if result else None
+    
+    def get_file_heatmap(self, repo_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most frequently changed files, ties kept in first-seen order"""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT path, COUNT(*) AS changes 
+                FROM commit_files 
+                WHERE repo_id = ? 
+                GROUP BY path 
+                ORDER BY changes DESC, MIN(rowid) 
+                LIMIT ?
+            """, (repo_id, limit)).fetchall()
         
-        # Check if record exists
-        cursor.execute("SELECT repo_id FROM analyses WHERE repo_id = ?", (repo_id,))
-        exists = cursor.fetchone()
+        return [{"file": path, "changes": changes} for path, changes in rows]
+    
+    def get_ownership(self, repo_id: str) -> List[Dict[str, Any]]:
+        """Commits and distinct files touched per author, most active first"""
+        with self._lock:
+            rows = self._conn.execute("""
+                WITH touched AS (
+                    SELECT c.author, COUNT(DISTINCT f.path) AS files_touched 
+                    FROM commit_files f 
+                    JOIN commits c ON c.repo_id = f.repo_id AND c.hash = f.hash 
+                    WHERE f.repo_id = ? 
+                    GROUP BY c.author
+                )
+                SELECT c.author, COUNT(*) AS commits, COALESCE(t.files_touched, 0) 
+                FROM commits c 
+                LEFT JOIN touched t ON t.author = c.author 
+                WHERE c.repo_id = ? 
+                GROUP BY c.author 
+                ORDER BY commits DESC, MIN(c.position)
+            """, (repo_id, repo_id)).fetchall()
         
-        if exists:
-            cursor.execute("""
-                UPDATE analyses 
-                SET status = ?, updated_at = ?, error_message = ?
-                WHERE repo_id = ?
-            """, (status, now, error_message, repo_id))
-        else:
-            cursor.execute("""
-                INSERT INTO analyses 
-                (repo_id, repo_url, status, created_at, updated_at, error_message)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (repo_id, "", status, now, now, error_message))
+        return [
+            {"author": author, "commits": commits, "files_touched": files_touched}
+            for author, commits, files_touched in rows
+        ]
+    
+    def find_cached_query(self, repo_id: str, embedding: np.ndarray, threshold: float) -> Optional[Dict[str, Any]]:
+        """Return the answer to the most similar cached query, if its cosine similarity reaches threshold"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid, embedding FROM query_cache WHERE repo_id = ?", (repo_id,)
+            ).fetchall()
+            if not rows:
+                return None
+            
+            # Embeddings are unit length, so one matrix-vector product gives every cosine similarity
+            matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+            scores = matrix @ embedding.astype(np.float32)
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                return None
+            
+            rowid = rows[best][0]
+            # GDSF: a hit re-prices the entry as floor + frequency / size
+            self._conn.execute("""
+                UPDATE query_cache 
+                SET hits = hits + 1, 
+                    priority = (SELECT MIN(priority) FROM query_cache) + (hits + 1.0) / size 
+                WHERE rowid = ?
+            """, (rowid,))
+            result = self._conn.execute("SELECT result FROM query_cache WHERE rowid = ?", (rowid,)).fetchone()[0]
         
-        conn.commit()
-        conn.close()
+        return orjson.loads(result)
+    
+    def store_cached_query(self, repo_id: str, query: str, embedding: np.ndarray, result: Dict[str, Any]):
+        """Cache a query answer, evicting the lowest-priority entries beyond capacity"""
+        payload = orjson.dumps(result)
+        now = _now()
+        
+        with self._transaction() as conn:
+            # GDSF inflation: new entries start from the current lowest priority, so
+            # entries that stopped getting hits age out instead of staying forever
+            floor = conn.execute("SELECT COALESCE(MIN(priority), 0) FROM query_cache").fetchone()[0]
+            conn.execute("""
+                INSERT INTO query_cache 
+                (repo_id, query, embedding, result, hits, size, priority, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                repo_id,
+                query,
+                embedding.astype(np.float32).tobytes(),
+                payload,
+                1,
+                len(payload),
+                floor + 1.0 / len(payload),
+                now
+            ))
+            conn.execute("""
+                DELETE FROM query_cache 
+                WHERE rowid IN (
+                    SELECT rowid FROM query_cache 
+                    ORDER BY priority 
+                    LIMIT MAX((SELECT COUNT(*) FROM query_cache) - ?, 0)
+                )
+            """, (QUERY_CACHE_CAPACITY,))
+    
+    def get_cached_embeddings(self, hashes: List[str], model: str) -> Dict[str, np.ndarray]:
+        """Look up cached embeddings by content hash, returned as float32"""
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                for content_hash, vec in self._conn.execute(f"""
+                    SELECT hash, vec FROM embedding_cache 
+                    WHERE model = ? AND hash IN ({placeholders})
+                """, (model, *chunk)):
+                    found[content_hash] = np.frombuffer(vec, dtype=np.float16).astype(np.float32)
+        
+        return found
+    
+    def store_cached_embeddings(self, embeddings: Dict[str, np.ndarray], model: str):
+        """Cache embeddings by content hash"""
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (hash, model, vec) VALUES (?, ?, ?)",
+                (
+                    (content_hash, model, vec.astype(np.float16).tobytes())
+                    for content_hash, vec in embeddings.items()
+                )
+            )
+    
+    def get_cached_completion(self, key: str) -> Optional[str]:
+        """Look up a cached completion by request hash"""
+        with self._lock:
+            result = self._conn.execute(
+                "SELECT response FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        
+        return result[0] if result else None
+    
+    def store_cached_completion(self, key: str, response: str):
+        """Cache a completion by request hash"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created_at) VALUES (?, ?, ?)",
+                (key, response, _now())
+            )
+    
+    def _load_commits(self, repo_id: str) -> List[Dict[str, Any]]:
+        """Rebuild commit dicts, in git log order, from the commit tables"""
+        files = {}
+        for commit_hash, path in self._conn.execute(
+            "SELECT hash, path FROM commit_files WHERE repo_id = ? ORDER BY rowid", (repo_id,)
+        ):
+            files.setdefault(commit_hash, []).append(path)
+        
+        commits = []
+        for row in self._conn.execute("""
+            SELECT hash, message, author, email, date, tz_offset, insertions, deletions, files_changed 
+            FROM commits 
+            WHERE repo_id = ? 
+            ORDER BY position
+        """, (repo_id,)):
+            commit_hash, message, author, email, date, tz_offset, insertions, deletions, files_changed = row
+            commits.append({
+                "hash": commit_hash,
+                "message": message,
+                "author": author,
+                "email": email,
+                "date": _unpack_date(date, tz_offset),
+                "date_ts": date,
+                "files": files.get(commit_hash, []),
+                "stats": {
+                    "insertions": insertions,
+                    "deletions": deletions,
+                    "files_changed": files_changed
+                }
+            })
+        
+        return commits
+    
+    def _delete_derived_rows(self, conn: sqlite3.Connection, repo_id: str):
+        """Remove the commit rows and cached answers of one analysis"""
+        conn.execute("DELETE FROM query_cache WHERE repo_id = ?", (repo_id,))
+        conn.execute("DELETE FROM visualizations WHERE repo_id = ?", (repo_id,))
+        conn.execute("DELETE FROM commit_files WHERE repo_id = ?", (repo_id,))
+        conn.execute("DELETE FROM commits WHERE repo_id = ?", (repo_id,))
+    
+    def update_analysis_status(self, repo_id: str, status: str, error_message: str = None):
+        """Update analysis status"""
+        now = _now()
+        
+        with self._transaction() as conn:
+            # Check if record exists
+            exists = conn.execute("SELECT repo_id FROM analyses WHERE repo_id = ?", (repo_id,)).fetchone()
+            
+            if exists:
+                conn.execute("""
+                    UPDATE analyses 
+                    SET status = ?, updated_at = ?, error_message = ?
+                    WHERE repo_id = ?
+                """, (status, now, error_message, repo_id))
+            else:
+                conn.execute("""
+                    INSERT INTO analyses 
+                    (repo_id, repo_url, status, created_at, updated_at, error_message)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (repo_id, "", status, now, now, error_message))
     
     def list_analyses(self) -> List[Dict[str, Any]]:
         """List all stored analyses"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT repo_id, repo_url, status, created_at, updated_at 
-            FROM analyses 
-            ORDER BY updated_at DESC
-        """)
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT repo_id, repo_url, status, created_at, updated_at 
+                FROM analyses 
+                ORDER BY updated_at DESC
+            """).fetchall()
         
         results = []
-        for row in cursor.fetchall():
+        for row in rows:
             repo_id, repo_url, status, created_at, updated_at = row
             results.append({
                 "repo_id": repo_id,
                 "repo_url": repo_url,
                 "status": status,
-                "created_at": created_at,
-                "updated_at": updated_at
+                "created_at": _format_timestamp(created_at),
+                "updated_at": _format_timestamp(updated_at)
             })
         
-        conn.close()
         return results
     
     def delete_analysis(self, repo_id: str):
         """Delete analysis by repository ID"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM analyses WHERE repo_id = ?", (repo_id,))
-        
-        conn.commit()
-        conn.close()
+        with self._transaction() as conn:
+            self._delete_derived_rows(conn, repo_id)
+            conn.execute("DELETE FROM analyses WHERE repo_id = ?", (repo_id,))
     
     def cleanup_old_analyses(self, days: int = 7):
-        """Remove analyses older than specified days"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cutoff_date = datetime.now().timestamp() - (days * 24 * 60 * 60)
-        cutoff_iso = datetime.fromtimestamp(cutoff_date).isoformat()
-        
-        cursor.execute("""
-            DELETE FROM analyses 
-            WHERE updated_at < ?
-        """, (cutoff_iso,))
-        
-        deleted_count = cursor.rowcount
-        conn.commit()
-        conn.close()
+        """Remove analyses and cached completions older than specified days"""
+        cutoff = _now() - days * 24 * 60 * 60 * 1_000_000
         
-        return deleted_count
\ No newline at end of file
+        with self._transaction() as conn:
+            for table in ("query_cache", "visualizations", "commit_files", "commits"):
+                conn.execute(f"""
+                    DELETE FROM {table} 
+                    WHERE repo_id IN (SELECT repo_id FROM analyses WHERE updated_at < ?)
+                """, (cutoff,))
+            conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (cutoff,))
+            cursor = conn.execute("""
+                DELETE FROM analyses 
+                WHERE updated_at < ?
+            """, (cutoff,))
+            
+            return cursor.rowcount
@@ -2,40 +2,105 @@ import git
 import os
 import tempfile
 import shutil
-from datetime import datetime
+from datetime import datetime, timezone
 import hashlib
-from typing import Dict, List, Any
+import subprocess
+import fcntl
+from contextlib import contextmanager
+from collections import Counter
+from typing import Dict, List, Any, Iterable, Iterator, Optional
+
+# One record per commit: header fields split by \x1f, then NUL-separated --numstat entries
+LOG_FORMAT = "%x1e%H%x1f%an%x1f%ae%x1f%cI%x1f%ct%x1f%B%x1f"
+RECORD_SEP = b"\x1e"
+FIELD_SEP = b"\x1f"
+
+# Number of repository clones kept on disk between analyses
+MAX_CACHED_REPOS = 20
+
+# File type by lowercased extension, without the leading dot
+TYPE_MAPPING = {
+    'py': 'python',
+    'js': 'javascript',
+    'ts': 'typescript',
+    'jsx': 'react',
+    'tsx': 'react',
+    'java': 'java',
+    'cpp': 'cpp',
+    'c': 'c',
+    'go': 'go',
+    'rs': 'rust',
+    'php': 'php',
+    'rb': 'ruby',
+    'md': 'markdown',
+    'json': 'json',
+    'yaml': 'yaml',
+    'yml': 'yaml',
+    'html': 'html',
+    'css': 'css',
+    'scss': 'scss',
+    'sql': 'sql'
+}
+
+def _parse_log_record(record: bytes) -> Dict[str, Any]:
+    """Parse one `git log -z --numstat` record into a commit dict"""
+    header, _, numstat = record.rpartition(FIELD_SEP)
+    hexsha, author, email, date, timestamp, message = header.decode("utf-8", "replace").split("\x1f", 5)
+    
+    files = []
+    insertions = deletions = 0
+    for entry in numstat.split(b"\x00"):
+        entry = entry.lstrip(b"\n")
+        if not entry:
+            continue
+        added, removed, path = entry.split(b"\t", 2)
+        # Binary files report "-" for both counts
+        if added != b"-":
+            insertions += int(added)
+            deletions += int(removed)
+        files.append(path.decode("utf-8", "replace"))
+    
+    return {
+        "hash": hexsha,
+        "message": message.strip(),
+        "author": author,
+        "email": email,
+        "date": date,
+        "date_ts": int(timestamp),
+        "files": files,
+        "stats": {
+            "insertions": insertions,
+            "deletions": deletions,
+            "files_changed": len(files)
+        }
+    }
 
 class GitAnalyzer:
-    def __init__(self):
-        self.temp_dir = tempfile.mkdtemp()
+    def __init__(self, cache_dir: Optional[str] = None):
+        # Clones persist across analyses (and worker processes) so re-analysis only fetches new history
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "codetime-navigator-repos")
+        os.makedirs(self.cache_dir, exist_ok=True)
     
     def get_repo_id(self, repo_url: str) -> str:
         """Generate unique ID for repository"""
-        return hashlib.md5(repo_url.encode()).hexdigest()
+        return hashlib.blake2b(repo_url.encode(), digest_size=16).hexdigest()
     
     def analyze_repository(self, repo_url: str, max_commits: int = 1000) -> Dict[str, Any]:
-        """Clone and analyze git repository"""
-        repo_path = os.path.join(self.temp_dir, self.get_repo_id(repo_url))
+        """Clone (or update) and analyze git repository"""
+        repo_path = os.path.join(self.cache_dir, f"{self.get_repo_id(repo_url)}.git")
         
         try:
-            # Clone repository
-            if os.path.exists(repo_path):
-                shutil.rmtree(repo_path)
-            
-            # Clone repository with optimizations for large repos
-            repo = git.Repo.clone_from(
-                repo_url, 
-                repo_path,
-                depth=min(max_commits + 100, 500),  # Very shallow clone based on needed commits
-                single_branch=True,  # Only clone main/master branch
-                progress=None  # Disable progress to avoid hanging
-            )
-            
-            # Extract commit data
-            commits = self._extract_commits(repo, max_commits)
-            files = self._extract_file_stats(repo)
-            stats = self._calculate_stats(commits, files)
+            with self._clone_in_use(repo_path):
+                repo = self._sync_clone(
+                    repo_url,
+                    repo_path,
+                    depth=min(max_commits + 100, 500)  # Very shallow clone based on needed commits
+                )
+                
+                # Extract commit data; stats are folded in while the log streams
+                commits = []
+                files = self._extract_file_stats(repo)
+                stats = self._calculate_stats(self._collect(self._iter_commits(repo_path, max_commits), commits), files)
             
             return {
                 "commits": commits,
@@ -46,63 +111,140 @@ class GitAnalyzer:
         except Exception as e:
             raise Exception(f"Failed to analyze repository: {str(e)}")
         finally:
-            # Cleanup
-            if os.path.exists(repo_path):
-                shutil.rmtree(repo_path)
+            self._evict_cached_clones(keep=repo_path)
+    
+    @contextmanager
+    def _clone_in_use(self, repo_path: str):
+        """Hold a shared lock on a clone so other workers' eviction skips it"""
+        # Lock files are never deleted: removing one could hand two processes different locks for the same clone
+        with open(f"{repo_path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            yield
     
-    def _extract_commits(self, repo: git.Repo, max_commits: int) -> List[Dict[str, Any]]:
-        """Extract commit data from repository"""
-        commits = []
+    def _sync_clone(self, repo_url: str, repo_path: str, depth: int) -> git.Repo:
+        """Fetch new history into the cached clone, cloning on first use"""
+        if os.path.exists(repo_path):
+            try:
+                os.utime(repo_path)  # Mark as recently used before the possibly slow fetch
+                repo = git.Repo(repo_path)
+                # Bare clones have no remote-tracking refspec, so map the remote's
+                # default branch straight onto the local branch
+                repo.git.fetch("origin", f"+HEAD:{repo.head.ref.path}", prune=True, depth=depth)
+                return repo
+            except Exception as e:
+                # A broken cache entry is simply cloned again
+                print(f"Error updating cached clone, re-cloning: {e}")
+                shutil.rmtree(repo_path, ignore_errors=True)
         
-        for i, commit in enumerate(repo.iter_commits()):
-            if i >= max_commits:
-                break
-            
-            # Get changed files
-            changed_files = []
-            if commit.parents:
-                # Compare with first parent
-                diffs = commit.parents[0].diff(commit)
-                changed_files = [diff.a_path or diff.b_path for diff in diffs]
-            
-            commit_data = {
-                "hash": commit.hexsha,
-                "message": commit.message.strip(),
-                "author": commit.author.name,
-                "email": commit.author.email,
-                "date": commit.committed_datetime.isoformat(),
-                "files": changed_files,
-                "stats": {
-                    "insertions": commit.stats.total["insertions"],
-                    "deletions": commit.stats.total["deletions"],
-                    "files_changed": commit.stats.total["files"]
-                }
-            }
-            
-            commits.append(commit_data)
+        # Clone repository with optimizations for large repos
+        return git.Repo.clone_from(
+            repo_url, 
+            repo_path,
+            depth=depth,
+            single_branch=True,  # Only clone main/master branch
+            bare=True,  # Only history is read, so skip writing a working tree
+            progress=None  # Disable progress to avoid hanging
+        )
+    
+    def _evict_cached_clones(self, keep: str):
+        """Delete the least recently used clones beyond MAX_CACHED_REPOS"""
+        try:
+            clones = [
+                os.path.join(self.cache_dir, name)
+                for name in os.listdir(self.cache_dir)
+                if name.endswith(".git")
+            ]
+            clones.sort(key=os.path.getmtime, reverse=True)
+            for path in clones[MAX_CACHED_REPOS:]:
+                if path != keep:
+                    self._remove_unused_clone(path)
+        except OSError as e:
+            print(f"Error evicting cached clones: {e}")
+    
+    def _remove_unused_clone(self, repo_path: str):
+        """Delete a clone unless an analysis in any process is using it"""
+        with open(f"{repo_path}.lock", "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            shutil.rmtree(repo_path, ignore_errors=True)
+    
+    def _iter_commits(self, repo_path: str, max_commits: int) -> Iterator[Dict[str, Any]]:
+        """Stream commit data from a single `git log` pass"""
+        proc = subprocess.Popen(
+            [
+                # Root commits and the grafted boundary of a shallow clone have no parent to
+                # diff against; without this git diffs them against the empty tree, listing every file
+                "git", "-C", repo_path, "-c", "log.showRoot=false", "log", "-z",
+                "--no-renames",
+                "--diff-merges=first-parent",  # Merges are diffed against their first parent
+                # Keep stats to git's internal diff: no gpg, external diff or textconv helper per commit
+                "--no-show-signature",
+                "--no-ext-diff",
+                "--no-textconv",
+                f"--pretty=format:{LOG_FORMAT}",
+                "--numstat",
+                "-n", str(max_commits)
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=1 << 20
+        )
         
-        return commits
+        try:
+            pending = b""
+            for chunk in iter(lambda: proc.stdout.read(1 << 16), b""):
+                records = (pending + chunk).split(RECORD_SEP)
+                pending = records.pop()  # Last record may still be incomplete
+                for record in records:
+                    if record:
+                        yield _parse_log_record(record)
+            if pending:
+                yield _parse_log_record(pending)
+            
+            stderr = proc.stderr.read()
+            if proc.wait() != 0:
+                raise Exception(f"git log failed: {stderr.decode('utf-8', 'replace').strip()}")
+        finally:
+            # Consumer stopped early or parsing failed: don't leave git running
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
     
     def _extract_file_stats(self, repo: git.Repo) -> Dict[str, Any]:
-        """Extract file statistics from repository (optimized for speed)"""
+        """Extract file statistics from a single `git ls-tree` pass over HEAD"""
         files = {}
         
-        # Only get top-level files and important directories for speed
         try:
-            file_count = 0
-            for item in repo.head.commit.tree.traverse():
-                if item.type == 'blob' and file_count < 100:  # Limit files processed
-                    file_path = item.path
-                    # Skip deep nested files or very large files
-                    if file_path.count('/') > 3 or item.size > 1000000:  # Skip files deeper than 3 levels or > 1MB
-                        continue
-                        
-                    files[file_path] = {
-                        "size": item.size,
-                        "type": self._get_file_type(file_path),
-                        "last_modified": repo.head.commit.committed_datetime.isoformat()
-                    }
-                    file_count += 1
+            last_modified = repo.head.commit.committed_datetime.isoformat()
+            output = subprocess.check_output(
+                ["git", "-C", repo.git_dir, "ls-tree", "-r", "-z", "--long", "HEAD"],
+                stderr=subprocess.PIPE
+            )
+            
+            # Entries look like "<mode> <type> <sha> <size>\t<path>"
+            for entry in output.split(b"\x00"):
+                if not entry:
+                    continue
+                meta, _, path = entry.partition(b"\t")
+                _, object_type, _, size = meta.split()
+                if object_type != b"blob":  # Submodules have no size
+                    continue
+                
+                file_path = path.decode("utf-8", "replace")
+                size = int(size)
+                # Skip files deeper than 3 levels or > 1MB
+                if file_path.count('/') > 3 or size > 1000000:
+                    continue
+                
+                files[file_path] = {
+                    "size": size,
+                    "type": self._get_file_type(file_path),
+                    "last_modified": last_modified
+                }
         except Exception as e:
             # If file traversal fails, return minimal data
             print(f"Error extracting file stats: {e}")
@@ -111,66 +253,62 @@ class GitAnalyzer:
     
     def _get_file_type(self, file_path: str) -> str:
         """Determine file type based on extension"""
-        ext = os.path.splitext(file_path)[1].lower()
-        
-        type_mapping = {
-            '.py': 'python',
-            '.js': 'javascript',
-            '.ts': 'typescript',
-            '.jsx': 'react',
-            '.tsx': 'react',
-            '.java': 'java',
-            '.cpp': 'cpp',
-            '.c': 'c',
-            '.go': 'go',
-            '.rs': 'rust',
-            '.php': 'php',
-            '.rb': 'ruby',
-            '.md': 'markdown',
-            '.json': 'json',
-            '.yaml': 'yaml',
-            '.yml': 'yaml',
-            '.html': 'html',
-            '.css': 'css',
-            '.scss': 'scss',
-            '.sql': 'sql'
-        }
-        
-        return type_mapping.get(ext, 'other')
+        stem, _, ext = file_path.rpartition('/')[2].rpartition('.')
+        # Like os.path.splitext, leading dots mark a hidden file rather than an extension
+        if not stem.lstrip('.'):
+            return 'other'
+        return TYPE_MAPPING.get(ext.lower(), 'other')
     
-    def _calculate_stats(self, commits: List[Dict], files: Dict) -> Dict[str, Any]:
-        """Calculate repository statistics"""
-        if not commits:
-            return {}
-        
-        # Time range
-        dates = [datetime.fromisoformat(c["date"].replace('Z', '+00:00')) for c in commits]
-        
-        # File type distribution
-        file_types = {}
-        for file_info in files.values():
-            file_type = file_info["type"]
-            file_types[file_type] = file_types.get(file_type, 0) + 1
+    def _collect(self, commits: Iterable[Dict[str, Any]], into: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Pass commits through while appending them to `into`"""
+        for commit in commits:
+            into.append(commit)
+            yield commit
+    
+    def _calculate_stats(self, commits: Iterable[Dict], files: Dict) -> Dict[str, Any]:
+        """Calculate repository statistics in a single pass over commits"""
+        total_commits = 0
+        total_insertions = 0
+        total_deletions = 0
+        start = end = None
         
-        # Author statistics
+        # Author statistics and time range
         authors = {}
         for commit in commits:
+            total_commits += 1
+            insertions = commit["stats"]["insertions"]
+            deletions = commit["stats"]["deletions"]
+            total_insertions += insertions
+            total_deletions += deletions
+            
+            timestamp = commit["date_ts"]
+            if start is None or timestamp < start:
+                start = timestamp
+            if end is None or timestamp > end:
+                end = timestamp
+            
             author = commit["author"]
             if author not in authors:
                 authors[author] = {"commits": 0, "insertions": 0, "deletions": 0}
             authors[author]["commits"] += 1
-            authors[author]["insertions"] += commit["stats"]["insertions"]
-            authors[author]["deletions"] += commit["stats"]["deletions"]
+            authors[author]["insertions"] += insertions
+            authors[author]["deletions"] += deletions
+        
+        if not total_commits:
+            return {}
+        
+        # File type distribution
+        file_types = Counter(file_info["type"] for file_info in files.values())
         
         return {
-            "total_commits": len(commits),
+            "total_commits": total_commits,
             "total_files": len(files),
-            "file_types": file_types,
+            "file_types": dict(file_types),
             "authors": authors,
             "date_range": {
-                "start": min(dates).isoformat(),
-                "end": max(dates).isoformat()
+                "start": datetime.fromtimestamp(start, timezone.utc).isoformat(),
+                "end": datetime.fromtimestamp(end, timezone.utc).isoformat()
             },
-            "total_insertions": sum(c["stats"]["insertions"] for c in commits),
-            "total_deletions": sum(c["stats"]["deletions"] for c in commits)
+            "total_insertions": total_insertions,
+            "total_deletions": total_deletions
         }
\ No newline at end of file
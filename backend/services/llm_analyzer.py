@@ -1,50 +1,228 @@
 import openai
 import anthropic
+import tiktoken
 import os
-import json
-from typing import List, Dict, Any
+import orjson
+import hashlib
+import heapq
+import random
+import re
+from functools import lru_cache
+import time
+import httpx
+import numpy as np
+from collections import Counter, defaultdict
+from operator import itemgetter
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
 import asyncio
+from bisect import bisect_left
+from .database import Database
+
+CHAT_MODEL = "gpt-3.5-turbo"
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Query prompts are trimmed to fit the budget with room left for the answer
+PROMPT_TOKEN_BUDGET = 8000
+COMPLETION_TOKEN_RESERVE = 800
+
+# Cosine similarity above which a cached answer is reused for a new query
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
+# Texts per embeddings request (the API accepts up to 2048), and how many requests may be in flight at once
+EMBEDDING_BATCH_SIZE = 1024
+MAX_CONCURRENT_EMBEDDING_CALLS = 8
+
+# Commits per categorization prompt, and how many prompts may be in flight at once
+CATEGORIZE_BATCH_SIZE = 64
+MAX_CONCURRENT_LLM_CALLS = 10
+
+# Sustained rate of OpenAI requests, with bursts of up to MAX_CONCURRENT_LLM_CALLS
+LLM_REQUESTS_PER_SECOND = 5
+
+# Transient failures are retried with exponential backoff starting from the base delay
+LLM_MAX_RETRIES = 3
+LLM_RETRY_BASE_DELAY = 1.0
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,  # includes timeouts
+    openai.InternalServerError,
+)
+
+# Connection pool shared by all API calls in a process
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+@lru_cache(maxsize=1)
+def get_openai_client() -> Optional[openai.AsyncOpenAI]:
+    """Process-wide OpenAI client, or None without an API key"""
+    api_key = os.getenv("OPENAI_API_KEY")
+    
+    # Handle missing API keys gracefully for development
+    if not api_key or api_key == "dummy_key_for_testing":
+        return None
+    try:
+        # Retries are handled by LLMAnalyzer so they share its rate limiter
+        return openai.AsyncOpenAI(
+            api_key=api_key,
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(limits=HTTP_LIMITS)
+        )
+    except Exception as e:
+        print(f"Error initializing OpenAI client: {e}")
+        return None
+
+@lru_cache(maxsize=1)
+def get_token_encoder() -> Optional[tiktoken.Encoding]:
+    """Process-wide tokenizer for CHAT_MODEL, or None if it cannot be loaded"""
+    try:
+        return tiktoken.encoding_for_model(CHAT_MODEL)
+    except Exception as e:
+        # The encoding is downloaded on first use, which fails offline
+        print(f"Error loading tokenizer, estimating token counts: {e}")
+        return None
+
+@lru_cache(maxsize=1)
+def get_anthropic_client() -> Optional[anthropic.AsyncAnthropic]:
+    """Process-wide Anthropic client, or None without an API key"""
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    
+    if not api_key or api_key == "dummy_key_for_testing":
+        return None
+    try:
+        return anthropic.AsyncAnthropic(api_key=api_key, connection_pool_limits=HTTP_LIMITS)
+    except Exception as e:
+        print(f"Error initializing Anthropic client: {e}")
+        return None
+
+# Commit categories by message keyword, in priority order; the first category with any keyword wins
+CATEGORY_KEYWORDS = {
+    "bugfix": ["fix", "bug", "error", "issue", "patch"],
+    "feature": ["feat", "add", "new", "implement", "create"],
+    "refactor": ["refactor", "restructure", "reorganize", "cleanup"],
+    "documentation": ["doc", "readme", "comment", "documentation"],
+    "test": ["test", "spec", "coverage"],
+    "style": ["style", "format", "lint", "prettier"],
+    "performance": ["perf", "optimize", "performance", "speed"],
+    "security": ["security", "auth", "permission", "vulnerability"],
+    "architecture": ["architecture", "design", "pattern", "structure"],
+    "build": ["build", "config", "setup", "deploy", "ci", "cd"],
+}
+
+# Commit scopes by changed file path fragment, in priority order: (extensions matched as written, words matched in any case)
+SCOPE_FRAGMENTS = {
+    "frontend": ((".js", ".ts", ".jsx", ".tsx"), ()),
+    "backend": ((".py", ".java", ".go", ".rb"), ()),
+    "test": ((), ("test", "spec")),
+    "documentation": ((), ("doc", "readme")),
+    "infrastructure": ((".yml", ".yaml"), ("config", "dockerfile")),
+}
+
+def _categorize_message(message: str) -> str:
+    """First category with a keyword anywhere in the message"""
+    # Plain substring checks over one casefolded copy beat any single regex over the whole table
+    text = message.casefold()
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        for keyword in keywords:
+            if keyword in text:
+                return category
+    return "unknown"
+
+def _detect_scope(files: List[str]) -> str:
+    """First scope with a fragment in any changed file path"""
+    paths = "\0".join(files)
+    folded = paths.casefold()
+    for scope, (extensions, words) in SCOPE_FRAGMENTS.items():
+        for extension in extensions:
+            if extension in paths:
+                return scope
+        for word in words:
+            if word in folded:
+                return scope
+    return "unknown"
+
+# Word tokens for the query relevance index
+TOKEN_RE = re.compile(r"\w+")
+
+# Commit lists whose relevance index and embeddings are kept between queries
+COMMIT_INDEX_CACHE_SIZE = 32
+
+# Keyword relevance: BM25 parameters, and term weights for a commit's message, category and files
+BM25_K1 = 1.2
+BM25_B = 0.75
+FIELD_WEIGHTS = (3, 2, 1)
+
+# Commits passed on from relevance ranking to the query prompt
+RELEVANT_COMMIT_LIMIT = 20
+
+# Categories whose commits feed architectural pattern detection
+ARCHITECTURAL_CATEGORIES = frozenset(("architecture", "refactor"))
+
+# Categories that make a commit a milestone candidate regardless of its size
+MILESTONE_CATEGORIES = frozenset(("architecture", "feature"))
+
+# Message keywords that mark a commit as a milestone regardless of its size
+MILESTONE_RE = re.compile(r"release|version|launch|initial|migration|major", re.IGNORECASE)
+
+# Abbreviated or full hashes and other numbers, masked when fingerprinting commit messages
+MESSAGE_FINGERPRINT_RE = re.compile(r"\b[0-9a-f]{7,40}\b|\d+")
+
+# JSON object inside a markdown code block of an LLM reply
+FENCED_JSON_RE = re.compile(r'```(?:json)?\s*(\{.*?\})\s*```', re.DOTALL)
+
+# Commit impact labels, indexed by level
+IMPACT_LEVELS = ("low", "medium", "high")
+
+def _impact_levels(files_changed: np.ndarray, lines_changed: np.ndarray) -> List[str]:
+    """Impact of each commit from its files-changed and lines-changed columns"""
+    level = ((files_changed > 3) | (lines_changed > 100)).astype(np.intp)
+    level[(files_changed > 10) | (lines_changed > 500)] = 2
+    return [IMPACT_LEVELS[i] for i in level.tolist()]
+
+class _TokenBucket:
+    """Async token bucket allowing `rate` acquisitions per second and bursts of `capacity`"""
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+    
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # No await between the check and the decrement, so this is atomic within the event loop
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
 
 class LLMAnalyzer:
-    def __init__(self):
-        openai_key = os.getenv("OPENAI_API_KEY")
-        anthropic_key = os.getenv("ANTHROPIC_API_KEY")
-        
-        # Handle missing API keys gracefully for development
-        if not openai_key or openai_key == "dummy_key_for_testing":
-            self.openai_client = None
-        else:
-            try:
-                openai.api_key = openai_key
-                self.openai_client = openai
-            except Exception as e:
-                print(f"Error initializing OpenAI client: {e}")
-                self.openai_client = None
-            
-        if not anthropic_key or anthropic_key == "dummy_key_for_testing":
-            self.anthropic_client = None
-        else:
-            try:
-                self.anthropic_client = anthropic.Anthropic(api_key=anthropic_key)
-            except Exception as e:
-                print(f"Error initializing Anthropic client: {e}")
-                self.anthropic_client = None
+    def __init__(self, db: Optional[Database] = None):
+        self.db = db
+        self._rate_limiter = _TokenBucket(LLM_REQUESTS_PER_SECOND, MAX_CONCURRENT_LLM_CALLS)
+        self._commit_indexes = {}
+        self._commit_vectors = {}
+        
+        # Clients are shared process-wide so every analyzer reuses the same connection pools
+        self.openai_client = get_openai_client()
+        self.anthropic_client = get_anthropic_client()
     
     async def analyze_patterns(self, commits: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Analyze commit patterns using LLM"""
         # Limit commits for faster processing
         limited_commits = commits[:200]  # Only analyze first 200 commits for speed
         
-        # Skip LLM categorization for development speed, use simple heuristics
-        categorized_commits = self._fast_categorize_commits(limited_commits)
+        # Skip LLM categorization for development speed, use simple heuristics;
+        # the same pass collects architectural commits and milestone candidates
+        categorized_commits, arch_commits, milestone_candidates = self._fast_categorize_commits(limited_commits)
+        
+        # Identify major milestones using fast heuristics
+        milestones = self._identify_milestones(milestone_candidates)
         
         # Only analyze architectural patterns for most important commits
-        arch_commits = [c for c in categorized_commits if c.get("category") in ["architecture", "refactor"]][:20]
+        arch_commits = arch_commits[:20]
         architectural_patterns = await self._detect_architectural_patterns(arch_commits) if arch_commits else []
         
-        # Identify major milestones using fast heuristics
-        milestones = self._identify_milestones(categorized_commits)
-        
         return {
             "categorized_commits": categorized_commits,
             "architectural_patterns": architectural_patterns,
@@ -52,159 +230,192 @@ class LLMAnalyzer:
         }
     
     async def _categorize_commits(self, commits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Categorize commits using GPT-4"""
-        categorized = []
-        batch_size = 20  # Process commits in batches
+        """Categorize commits in place using GPT, one request per batch with batches in flight concurrently"""
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
         
-        for i in range(0, len(commits), batch_size):
-            batch = commits[i:i + batch_size]
-            
-            # Prepare commit data for analysis
-            commit_texts = []
-            for commit in batch:
-                text = f"Message: {commit['message']}\nFiles: {', '.join(commit['files'][:5])}\nStats: +{commit['stats']['insertions']} -{commit['stats']['deletions']}"
-                commit_texts.append(text)
-            
-            prompt = f"""
-            Analyze these git commits and categorize each one. For each commit, determine:
-            1. Category: feature, bugfix, refactor, documentation, test, architecture, performance, security, style
-            2. Scope: frontend, backend, database, infrastructure, build, deployment, api, ui, core
-            3. Impact: low, medium, high (based on files changed and lines modified)
-            4. Description: brief 1-sentence summary of what changed
-            
-            Commits to analyze:
-            {chr(10).join(f"{i+1}. {text}" for i, text in enumerate(commit_texts))}
-            
-            Return a JSON array with objects containing: category, scope, impact, description for each commit.
-            """
-            
-            try:
-                if not self.openai_client:
-                    # Fallback for development without API key
-                    analysis = [{"category": "unknown", "scope": "unknown", "impact": "medium", "description": commit["message"][:100]} for commit in batch]
-                else:
-                    response = await openai.ChatCompletion.acreate(
-                        model="gpt-3.5-turbo",
-                        messages=[{"role": "user", "content": prompt}],
-                        temperature=0.3
-                    )
-                    
-                    content = response.choices[0].message.content
-                    if not content or content.strip() == "":
-                        raise ValueError("Empty response from OpenAI API")
-                    
-                    try:
-                        analysis = json.loads(content)
-                    except json.JSONDecodeError:
-                        # Fallback if JSON parsing fails
-                        analysis = [{"category": "unknown", "scope": "unknown", "impact": "medium", "description": commit["message"][:100]} for commit in batch]
-                
-                # Merge analysis with original commits
-                for j, commit_analysis in enumerate(analysis):
-                    if i + j < len(commits):
-                        enhanced_commit = commits[i + j].copy()
-                        enhanced_commit.update(commit_analysis)
-                        categorized.append(enhanced_commit)
-                
-            except Exception as e:
-                # Fallback: add original commits without categorization
-                print(f"Error categorizing commits batch {i}: {e}")
-                for commit in batch:
-                    enhanced_commit = commit.copy()
-                    enhanced_commit.update({
-                        "category": "unknown",
-                        "scope": "unknown", 
-                        "impact": "medium",
-                        "description": commit["message"][:100]
-                    })
-                    categorized.append(enhanced_commit)
-            
-            # Rate limiting
-            await asyncio.sleep(0.5)
+        async def run(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            async with semaphore:
+                return await self._categorize_batch(batch)
+        
+        # Commits whose messages differ only in numbers or hashes share one categorization
+        groups = defaultdict(list)
+        for index, commit in enumerate(commits):
+            groups[MESSAGE_FINGERPRINT_RE.sub("#", commit["message"].casefold().strip())].append(index)
+        representatives = [commits[indices[0]] for indices in groups.values()]
+        
+        batches = [representatives[i:i + CATEGORIZE_BATCH_SIZE] for i in range(0, len(representatives), CATEGORIZE_BATCH_SIZE)]
+        results = await asyncio.gather(*(run(batch) for batch in batches))
         
-        return categorized
+        analyses = (analysis for batch in results for analysis in batch)
+        for analysis, indices in zip(analyses, groups.values()):
+            for index in indices:
+                commits[index].update(analysis)
+        return commits
     
-    def _fast_categorize_commits(self, commits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Fast commit categorization using keyword heuristics"""
-        categorized = []
+    async def _categorize_batch(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Categorize one batch of commits with a single completion request, returning one analysis per commit"""
+        # Prepare commit data for analysis
+        commit_texts = []
+        for commit in batch:
+            text = f"Message: {commit['message']}\nFiles: {', '.join(commit['files'][:5])}\nStats: +{commit['stats']['insertions']} -{commit['stats']['deletions']}"
+            commit_texts.append(text)
         
-        for commit in commits:
-            message = commit["message"].lower()
-            files = commit.get("files", [])
-            
-            # Simple keyword-based categorization
-            category = "unknown"
-            scope = "unknown"
-            impact = "medium"
-            
-            # Categorization heuristics
-            if any(word in message for word in ["fix", "bug", "error", "issue", "patch"]):
-                category = "bugfix"
-            elif any(word in message for word in ["feat", "add", "new", "implement", "create"]):
-                category = "feature"
-            elif any(word in message for word in ["refactor", "restructure", "reorganize", "cleanup"]):
-                category = "refactor"
-            elif any(word in message for word in ["doc", "readme", "comment", "documentation"]):
-                category = "documentation"
-            elif any(word in message for word in ["test", "spec", "coverage"]):
-                category = "test"
-            elif any(word in message for word in ["style", "format", "lint", "prettier"]):
-                category = "style"
-            elif any(word in message for word in ["perf", "optimize", "performance", "speed"]):
-                category = "performance"
-            elif any(word in message for word in ["security", "auth", "permission", "vulnerability"]):
-                category = "security"
-            elif any(word in message for word in ["architecture", "design", "pattern", "structure"]):
-                category = "architecture"
-            elif any(word in message for word in ["build", "config", "setup", "deploy", "ci", "cd"]):
-                category = "build"
-            
-            # Scope detection
-            if any(".js" in f or ".ts" in f or ".jsx" in f or ".tsx" in f for f in files):
-                scope = "frontend"
-            elif any(".py" in f or ".java" in f or ".go" in f or ".rb" in f for f in files):
-                scope = "backend"
-            elif any("test" in f.lower() or "spec" in f.lower() for f in files):
-                scope = "test"
-            elif any("doc" in f.lower() or "readme" in f.lower() for f in files):
-                scope = "documentation"
-            elif any("config" in f.lower() or "dockerfile" in f.lower() or ".yml" in f or ".yaml" in f for f in files):
-                scope = "infrastructure"
-            
-            # Impact based on files changed and stats
-            files_changed = commit["stats"].get("files_changed", 0)
-            lines_changed = commit["stats"].get("insertions", 0) + commit["stats"].get("deletions", 0)
-            
-            if files_changed > 10 or lines_changed > 500:
-                impact = "high"
-            elif files_changed > 3 or lines_changed > 100:
-                impact = "medium"
+        prompt = f"""
+        Analyze these git commits and categorize each one. For each commit, determine:
+        1. Category: feature, bugfix, refactor, documentation, test, architecture, performance, security, style
+        2. Scope: frontend, backend, database, infrastructure, build, deployment, api, ui, core
+        3. Impact: low, medium, high (based on files changed and lines modified)
+        4. Description: brief 1-sentence summary of what changed
+        
+        Commits to analyze:
+        {chr(10).join(f"{i+1}. {text}" for i, text in enumerate(commit_texts))}
+        
+        Return a JSON object with a "commits" array holding one object per commit, in the same order,
+        with keys: category, scope, impact, description.
+        """
+        
+        try:
+            if not self.openai_client:
+                # Fallback for development without API key
+                analysis = [{"category": "unknown", "scope": "unknown", "impact": "medium", "description": commit["message"][:100]} for commit in batch]
             else:
-                impact = "low"
-            
-            enhanced_commit = commit.copy()
-            enhanced_commit.update({
+                # JSON mode guarantees the reply parses, so only its shape can be wrong
+                content = await self._chat_completion(
+                    model=CHAT_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.3,
+                    response_format={"type": "json_object"}
+                )
+                analysis = orjson.loads(content)["commits"]
+                if len(analysis) != len(batch):
+                    raise ValueError(f"Expected {len(batch)} commit analyses, got {len(analysis)}")
+        
+        except Exception as e:
+            # Fallback: leave the commits uncategorized
+            print(f"Error categorizing commits batch: {e}")
+            analysis = [{
+                "category": "unknown",
+                "scope": "unknown",
+                "impact": "medium",
+                "description": commit["message"][:100]
+            } for commit in batch]
+        
+        return analysis
+    
+    async def _create_chat_completion(self, **kwargs):
+        """Create a chat completion under the rate limit, retrying transient failures"""
+        return await self._openai_request(self.openai_client.chat.completions.create, **kwargs)
+    
+    async def _openai_request(self, create, **kwargs):
+        """Make an OpenAI API request under the rate limit, retrying transient failures"""
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await self._rate_limiter.acquire()
+            try:
+                return await create(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+                # Full jitter keeps concurrent batches from retrying in lockstep
+                delay = LLM_RETRY_BASE_DELAY * 2 ** attempt * random.random()
+                print(f"Retrying OpenAI request in {delay:.1f}s after error: {e}")
+                await asyncio.sleep(delay)
+    
+    async def _chat_completion(self, **kwargs) -> str:
+        """Create a chat completion and return its text"""
+        response = await self._create_chat_completion(**kwargs)
+        content = response.choices[0].message.content
+        if not content or content.strip() == "":
+            raise ValueError("Empty response from OpenAI API")
+        return content
+    
+    async def _anthropic_completion(self, **kwargs) -> str:
+        """Create an Anthropic completion and return its text"""
+        response = await self.anthropic_client.completions.create(**kwargs)
+        return response.completion
+    
+    def _completion_key(self, request: Dict[str, Any]) -> str:
+        """Cache key for a completion request"""
+        return hashlib.blake2b(orjson.dumps(request, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+    
+    async def _stream_chat(self, **request) -> AsyncIterator[str]:
+        """Stream a chat completion's text as it arrives, replaying the stored reply to an identical earlier request;
+        callers store a reply with _store_completion once they have checked it is usable"""
+        if self.db:
+            cached = await asyncio.to_thread(self.db.get_cached_completion, self._completion_key(request))
+            if cached is not None:
+                yield cached
+                return
+        
+        parts = []
+        response = await self._create_chat_completion(stream=True, **request)
+        async for chunk in response:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+        
+        if not "".join(parts).strip():
+            raise ValueError("Empty response from OpenAI API")
+    
+    async def _store_completion(self, request: Dict[str, Any], content: str):
+        """Store the reply to a completion request for identical later requests"""
+        if self.db:
+            await asyncio.to_thread(self.db.store_cached_completion, self._completion_key(request), content)
+    
+    def _fast_categorize_commits(self, commits: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Fast in-place keyword categorization over the batch, also returning its architectural commits and milestone candidates"""
+        # Classify every message, then every changed-file list
+        messages = [commit["message"] for commit in commits]
+        categories = list(map(_categorize_message, messages))
+        scopes = [_detect_scope(commit.get("files", [])) for commit in commits]
+        
+        # Impact based on files changed and stats, computed over numeric columns
+        files_changed = np.fromiter((commit["stats"].get("files_changed", 0) for commit in commits), dtype=np.int64, count=len(commits))
+        insertions = np.fromiter((commit["stats"].get("insertions", 0) for commit in commits), dtype=np.int64, count=len(commits))
+        deletions = np.fromiter((commit["stats"].get("deletions", 0) for commit in commits), dtype=np.int64, count=len(commits))
+        impacts = _impact_levels(files_changed, insertions + deletions)
+        
+        arch_commits = []
+        milestone_candidates = []
+        for commit, message, category, scope, impact, changed in zip(
+            commits, messages, categories, scopes, impacts, files_changed.tolist()
+        ):
+            commit.update({
                 "category": category,
                 "scope": scope,
                 "impact": impact,
-                "description": commit["message"][:100]
+                "description": message[:100]
             })
-            categorized.append(enhanced_commit)
+            if category in ARCHITECTURAL_CATEGORIES:
+                arch_commits.append(commit)
+            if (impact == "high" or
+                category in MILESTONE_CATEGORIES or
+                changed > 10 or
+                MILESTONE_RE.search(message)):
+                milestone_candidates.append(commit)
         
-        return categorized
+        return commits, arch_commits, milestone_candidates
     
-    async def _detect_architectural_patterns(self, commits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Detect architectural patterns and decisions"""
-        # Filter architectural commits
-        arch_commits = [c for c in commits if c.get("category") in ["architecture", "refactor"]]
-        
+    async def _detect_architectural_patterns(self, arch_commits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Detect architectural patterns and decisions in the architectural commits picked while categorizing"""
         if not arch_commits:
             return []
         
+        # Patterns depend only on which architectural commits there are, so re-analyses
+        # of a history whose architectural commits are unchanged reuse the stored result
+        key = "arch:" + hashlib.blake2b(
+            orjson.dumps(sorted((c["hash"], c["message"]) for c in arch_commits)),
+            digest_size=16
+        ).hexdigest()
+        if self.db:
+            cached = await asyncio.to_thread(self.db.get_cached_completion, key)
+            if cached is not None:
+                return orjson.loads(cached)
+        
         # Analyze architectural evolution
         commit_summary = "\n".join([
             f"- {c['date']}: {c['message']} (Files: {', '.join(c['files'][:3])})"
-            for c in arch_commits[:20]  # Limit to most recent architectural changes
+            for c in arch_commits
         ])
         
         prompt = f"""
@@ -226,72 +437,173 @@ class LLMAnalyzer:
                 # Fallback for development without API key
                 return []
             
-            response = await self.anthropic_client.acompletion(
+            content = await self._anthropic_completion(
                 model="claude-instant-1",
                 max_tokens_to_sample=1000,
                 prompt=f"\n\nHuman: {prompt}\n\nAssistant:"
             )
             
-            content = response.completion
             if not content or content.strip() == "":
                 return []
             
             try:
-                return json.loads(content)
-            except json.JSONDecodeError:
+                patterns = orjson.loads(content)
+            except orjson.JSONDecodeError:
                 # Return empty array if JSON parsing fails
                 return []
+            
+            if self.db:
+                await asyncio.to_thread(self.db.store_cached_completion, key, orjson.dumps(patterns).decode())
+            return patterns
         
         except Exception as e:
             print(f"Error detecting architectural patterns: {e}")
             return []
     
-    def _identify_milestones(self, commits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Identify major project milestones"""
-        # Filter high-impact commits
-        milestones = []
-        
-        for commit in commits:
-            if (commit.get("impact") == "high" or 
-                commit.get("category") in ["architecture", "feature"] or
-                commit["stats"]["files_changed"] > 10 or
-                any(keyword in commit["message"].lower() 
-                    for keyword in ["release", "version", "launch", "initial", "migration", "major"])):
-                
-                milestones.append({
-                    "date": commit["date"],
-                    "title": commit["message"][:100],
-                    "description": commit.get("description", commit["message"]),
-                    "category": commit.get("category", "unknown"),
-                    "impact": commit.get("impact", "medium"),
-                    "author": commit["author"],
-                    "files_changed": commit["stats"]["files_changed"]
-                })
-        
-        # Sort by date and return top milestones
-        milestones.sort(key=lambda x: x["date"], reverse=True)
-        return milestones[:20]
+    def _identify_milestones(self, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Identify major project milestones among high-impact candidate commits"""
+        # Keep the 20 most recent, building milestone entries only for those
+        return [
+            {
+                "date": commit["date"],
+                "title": commit["message"][:100],
+                "description": commit.get("description", commit["message"]),
+                "category": commit.get("category", "unknown"),
+                "impact": commit.get("impact", "medium"),
+                "author": commit["author"],
+                "files_changed": commit["stats"]["files_changed"]
+            }
+            for commit in heapq.nlargest(20, candidates, key=itemgetter("date"))
+        ]
+    
+    async def embed(self, texts: List[str]) -> Optional[np.ndarray]:
+        """Embed texts as unit-length float32 rows, or None without an OpenAI key"""
+        if not self.openai_client:
+            return None
+        
+        # Memoize by content hash so repeated texts never reach the API twice
+        hashes = [hashlib.blake2b(text.encode(), digest_size=16).hexdigest() for text in texts]
+        vectors = await asyncio.to_thread(self.db.get_cached_embeddings, hashes, EMBEDDING_MODEL) if self.db else {}
+        
+        # Distinct texts that missed the cache go out in large batches, several at a time
+        missing = {}
+        for content_hash, text in zip(hashes, texts):
+            if content_hash not in vectors:
+                missing.setdefault(content_hash, text)
+        if missing:
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_EMBEDDING_CALLS)
+            
+            async def run(batch: List[str]) -> np.ndarray:
+                async with semaphore:
+                    response = await self._openai_request(
+                        self.openai_client.embeddings.create, model=EMBEDDING_MODEL, input=batch
+                    )
+                data = sorted(response.data, key=lambda item: item.index)
+                return np.array([item.embedding for item in data], dtype=np.float32)
+            
+            pending = list(missing.values())
+            batches = [pending[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(pending), EMBEDDING_BATCH_SIZE)]
+            fresh = np.concatenate(await asyncio.gather(*(run(batch) for batch in batches)))
+            fresh /= np.linalg.norm(fresh, axis=1, keepdims=True)
+            computed = dict(zip(missing, fresh))
+            if self.db:
+                await asyncio.to_thread(self.db.store_cached_embeddings, computed, EMBEDDING_MODEL)
+            vectors.update(computed)
+        
+        return np.stack([vectors[content_hash] for content_hash in hashes])
+    
+    async def _embed_query(self, query: str) -> Optional[np.ndarray]:
+        """Embed a query for the semantic cache; failures just skip the cache"""
+        if not self.db:
+            return None
+        try:
+            vectors = await self.embed([query])
+        except Exception as e:
+            print(f"Error embedding query: {e}")
+            return None
+        return vectors[0] if vectors is not None else None
     
-    async def process_query(self, query: str, commits: List[Dict], patterns: Dict) -> Dict[str, Any]:
+    async def process_query(self, query: str, commits: List[Dict], patterns: Dict, repo_id: Optional[str] = None) -> Dict[str, Any]:
         """Process natural language query about the repository"""
+        async for event in self.stream_query(query, commits, patterns, repo_id):
+            if event["type"] == "result":
+                return event["result"]
+    
+    async def stream_query(self, query: str, commits: List[Dict], patterns: Dict, repo_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Answer a query as a stream of {"type": "delta"} text events followed by one {"type": "result"} event"""
+        # Paraphrases of an earlier question about the same repository reuse its answer
+        query_embedding = await self._embed_query(query) if repo_id else None
+        if query_embedding is not None:
+            cached = await asyncio.to_thread(
+                self.db.find_cached_query, repo_id, query_embedding, SEMANTIC_CACHE_THRESHOLD
+            )
+            if cached is not None:
+                yield {"type": "result", "result": cached}
+                return
+        
         # Use only the most relevant commits for faster processing
-        relevant_commits = self._filter_relevant_commits(query, commits[:50])  # Limit to 50 most recent
+        relevant_commits = await self._find_relevant_commits(query, commits[:50], query_embedding)  # Limit to 50 most recent
         
         # Prepare context from analysis
         context = {
             "total_commits": len(commits),
-            "categories": {},
+            "categories": dict(Counter(commit.get("category", "unknown") for commit in relevant_commits)),  # From limited set
             "recent_commits": relevant_commits[:5],  # Even fewer for context
             "patterns": patterns.get("architectural_patterns", [])[:3],  # Limit patterns
             "milestones": patterns.get("milestones", [])[:5]  # Limit milestones
         }
         
-        # Count categories from limited set
-        for commit in relevant_commits:
-            category = commit.get("category", "unknown")
-            context["categories"][category] = context["categories"].get(category, 0) + 1
+        # Compact JSON, dropping the least relevant commits until the prompt fits the token budget
+        recent_commits = [orjson.dumps(commit).decode() for commit in context["recent_commits"]]
+        prompt = self._build_query_prompt(query, context, recent_commits)
+        while recent_commits and self._count_tokens(prompt) + COMPLETION_TOKEN_RESERVE > PROMPT_TOKEN_BUDGET:
+            recent_commits.pop()
+            prompt = self._build_query_prompt(query, context, recent_commits)
         
-        prompt = f"""
+        try:
+            if not self.openai_client:
+                # Fallback for development without API key
+                yield {"type": "result", "result": {
+                    "answer": f"Based on the repository analysis, there are {context['total_commits']} commits. This is a development environment response.",
+                    "evidence": [{"commit": "demo", "description": "Demo evidence for development"}],
+                    "timeline": [{"date": "2024", "event": "Demo timeline for development"}],
+                    "insights": ["This is a demo response for development environment"]
+                }}
+                return
+            
+            # Relay text as it arrives; the JSON answer can only be parsed once complete
+            request = {
+                "model": CHAT_MODEL,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0.3
+            }
+            parts = []
+            async for delta in self._stream_chat(**request):
+                parts.append(delta)
+                yield {"type": "delta", "content": delta}
+            
+            content = "".join(parts)
+            result, parsed = self._parse_query_response(content)
+            # Raw-text fallbacks are not cached, or a malformed reply would answer every
+            # repeat of the question and every paraphrase of it
+            if parsed:
+                await self._store_completion(request, content)
+                if query_embedding is not None:
+                    await asyncio.to_thread(self.db.store_cached_query, repo_id, query, query_embedding, result)
+        
+        except Exception as e:
+            result = {
+                "answer": f"Error processing query: {str(e)}",
+                "evidence": [],
+                "timeline": [],
+                "insights": []
+            }
+        
+        yield {"type": "result", "result": result}
+    
+    def _build_query_prompt(self, query: str, context: Dict[str, Any], recent_commits: List[str]) -> str:
+        """Render the query prompt around pre-serialized commits"""
+        return f"""
         You are analyzing a git repository. Answer this question based on the commit history and patterns:
         
         Question: {query}
@@ -299,9 +611,9 @@ class LLMAnalyzer:
         Repository Context:
         - Total commits: {context['total_commits']}
         - Commit categories: {context['categories']}
-        - Recent commits: {json.dumps(context['recent_commits'][:5], indent=2)}
-        - Architectural patterns: {json.dumps(context['patterns'][:3], indent=2)}
-        - Key milestones: {json.dumps(context['milestones'][:5], indent=2)}
+        - Recent commits: [{",".join(recent_commits)}]
+        - Architectural patterns: {orjson.dumps(context['patterns'][:3]).decode()}
+        - Key milestones: {orjson.dumps(context['milestones'][:5]).decode()}
         
         Provide a comprehensive answer with:
         1. Direct answer to the question
@@ -311,78 +623,123 @@ class LLMAnalyzer:
         
         Format as JSON with: answer, evidence, timeline, insights.
         """
-        
+    
+    def _count_tokens(self, text: str) -> int:
+        """Count tokens with the chat model's tokenizer, estimating when it cannot be loaded"""
+        encoder = get_token_encoder()
+        if encoder is None:
+            return len(text) // 4 + 1
+        return len(encoder.encode(text))
+    
+    def _parse_query_response(self, content: str) -> Tuple[Dict[str, Any], bool]:
+        """Parse the JSON answer to a query, tolerating markdown fences and plain text; also returns whether it was JSON"""
         try:
-            if not self.openai_client:
-                # Fallback for development without API key
-                return {
-                    "answer": f"Based on the repository analysis, there are {context['total_commits']} commits. This is a development environment response.",
-                    "evidence": [{"commit": "demo", "description": "Demo evidence for development"}],
-                    "timeline": [{"date": "2024", "event": "Demo timeline for development"}],
-                    "insights": ["This is a demo response for development environment"]
-                }
-            
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3
-            )
+            return orjson.loads(content), True
+        except orjson.JSONDecodeError as e:
+            # Try to extract JSON from markdown code blocks
+            json_match = FENCED_JSON_RE.search(content)
+            if json_match:
+                try:
+                    return orjson.loads(json_match.group(1)), True
+                except orjson.JSONDecodeError:
+                    pass
             
-            content = response.choices[0].message.content
-            if not content or content.strip() == "":
-                raise ValueError("Empty response from OpenAI API")
-            
-            try:
-                return json.loads(content)
-            except json.JSONDecodeError as e:
-                # Try to extract JSON from markdown code blocks
-                import re
-                json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', content, re.DOTALL)
-                if json_match:
-                    try:
-                        return json.loads(json_match.group(1))
-                    except json.JSONDecodeError:
-                        pass
-                
-                # If JSON parsing fails, return the raw content in a structured format
-                return {
-                    "answer": content,
-                    "evidence": [],
-                    "timeline": [],
-                    "insights": ["Raw response - JSON parsing failed"]
-                }
-        
-        except Exception as e:
+            # If JSON parsing fails, return the raw content in a structured format
             return {
-                "answer": f"Error processing query: {str(e)}",
+                "answer": content,
                 "evidence": [],
                 "timeline": [],
-                "insights": []
-            }
+                "insights": ["Raw response - JSON parsing failed"]
+            }, False
+    
+    async def _find_relevant_commits(self, query: str, commits: List[Dict], query_embedding: Optional[np.ndarray]) -> List[Dict]:
+        """Rank commits by embedding similarity to the query, falling back to BM25 keyword scoring"""
+        if query_embedding is not None and commits:
+            try:
+                vectors = await self._get_commit_vectors(commits)
+            except Exception as e:
+                print(f"Error embedding commits: {e}")
+                vectors = None
+            if vectors is not None:
+                # Cosine similarity of unit vectors is one float32 matrix-vector product (BLAS-backed,
+                # unlike float16); ties keep commit order
+                scores = vectors @ query_embedding
+                top = np.argsort(-scores, kind="stable")[:RELEVANT_COMMIT_LIMIT]
+                return [commits[i] for i in top]
+        
+        return self._filter_relevant_commits(query, commits)
+    
+    async def _get_commit_vectors(self, commits: List[Dict]) -> Optional[np.ndarray]:
+        """Float32 embedding matrix of the commits, kept in memory per distinct list of commits"""
+        key = tuple(commit["hash"] for commit in commits)
+        vectors = self._commit_vectors.pop(key, None)
+        if vectors is None:
+            vectors = await self.embed([self._commit_text(commit) for commit in commits])
+            if vectors is None:
+                return None
+        self._remember(self._commit_vectors, key, vectors)
+        return vectors
+    
+    def _remember(self, cache: Dict, key: Any, value: Any):
+        """Insert into a per-commit-list cache ordered from least to most recently used"""
+        if len(cache) >= COMMIT_INDEX_CACHE_SIZE:
+            del cache[next(iter(cache))]
+        cache[key] = value
+    
+    def _commit_text(self, commit: Dict) -> str:
+        """Text embedded for a commit in relevance search"""
+        return f"{commit['message']}\nFiles: {', '.join(commit.get('files', [])[:5])}"
     
     def _filter_relevant_commits(self, query: str, commits: List[Dict]) -> List[Dict]:
         """Filter commits that might be relevant to the query"""
-        query_words = query.lower().split()
-        relevant_commits = []
+        vocabulary, postings = self._get_commit_index(commits)
         
-        for commit in commits:
-            message = commit.get("message", "").lower()
-            category = commit.get("category", "").lower()
-            files = " ".join(commit.get("files", [])).lower()
-            
-            # Simple relevance scoring
-            relevance_score = 0
-            for word in query_words:
-                if word in message:
-                    relevance_score += 3
-                if word in category:
-                    relevance_score += 2
-                if word in files:
-                    relevance_score += 1
+        # BM25: a query word scores through every indexed token it is a prefix of ("auth" matches
+        # "authentication"), which form one contiguous run of the sorted vocabulary
+        scores = np.zeros(len(commits))
+        for word in TOKEN_RE.findall(query.casefold()):
+            i = bisect_left(vocabulary, word)
+            while i < len(vocabulary) and vocabulary[i].startswith(word):
+                positions, weights = postings[i]
+                scores[positions] += weights
+                i += 1
+        
+        relevant_commits = [
+            (commit, score) for commit, score in zip(commits, scores.tolist())
+            if score > 0 or commit.get("impact") == "high"
+        ]
+        
+        # Return the top commits by relevance; ties keep commit order as a stable sort would
+        top = heapq.nlargest(RELEVANT_COMMIT_LIMIT, relevant_commits, key=itemgetter(1))
+        return [commit for commit, score in top]
+    
+    def _get_commit_index(self, commits: List[Dict]) -> Tuple[List[str], List[Tuple[np.ndarray, np.ndarray]]]:
+        """Sorted token vocabulary with each token's commit positions and BM25 weights, built once per distinct list of commits"""
+        key = tuple(commit["hash"] for commit in commits)
+        index = self._commit_indexes.pop(key, None)
+        if index is None:
+            # Term frequencies and document lengths count message tokens 3x, category 2x, files 1x
+            frequencies = defaultdict(lambda: defaultdict(int))
+            lengths = np.zeros(len(commits))
+            for position, commit in enumerate(commits):
+                fields = (commit.get("message", ""), commit.get("category", ""), " ".join(commit.get("files", [])))
+                for text, weight in zip(fields, FIELD_WEIGHTS):
+                    tokens = TOKEN_RE.findall(text.casefold())
+                    lengths[position] += weight * len(tokens)
+                    for token in tokens:
+                        frequencies[token][position] += weight
             
-            if relevance_score > 0 or commit.get("impact") == "high":
-                relevant_commits.append((commit, relevance_score))
+            # Term weights depend only on the commits, so the whole BM25 formula except the sum is precomputed
+            norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1)) if commits else lengths
+            vocabulary = sorted(frequencies)
+            postings = []
+            for token in vocabulary:
+                counts = frequencies[token]
+                positions = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+                tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+                idf = np.log(1 + (len(commits) - len(counts) + 0.5) / (len(counts) + 0.5))
+                postings.append((positions, idf * tf * (BM25_K1 + 1) / (tf + norms[positions])))
+            index = (vocabulary, postings)
         
-        # Sort by relevance and return top commits
-        relevant_commits.sort(key=lambda x: x[1], reverse=True)
-        return [commit for commit, score in relevant_commits[:20]]
\ No newline at end of file
+        self._remember(self._commit_indexes, key, index)
+        return index
@@ -2,10 +2,16 @@
 
 import sys
 import os
+import asyncio
+import subprocess
+import tempfile
+from types import SimpleNamespace
+import numpy as np
 sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
 
-from services.git_analyzer import GitAnalyzer
+from services.git_analyzer import GitAnalyzer, _parse_log_record
 from services.database import Database
+from services.llm_analyzer import LLMAnalyzer
 
 def test_git_analyzer():
     print("Testing Git Analyzer...")
@@ -48,11 +54,110 @@ def test_database():
             
         # Cleanup
         db.delete_analysis("test123")
+        db.close()
         os.remove("test.db")
         
     except Exception as e:
         print(f"✗ Database error: {e}")
 
+def test_parse_log_record():
+    print("\nTesting git log parsing...")
+    record = (
+        b"abc123\x1fA B\x1fa@b.c\x1f2024-01-02T03:04:05+01:00\x1f1704161045\x1fFix bug\n\nDetails\n\x1f"
+        b"\n3\t1\tsrc/app.py\x00-\t-\timg.png\x00"
+    )
+    commit = _parse_log_record(record)
+    
+    assert commit["hash"] == "abc123"
+    assert commit["message"] == "Fix bug\n\nDetails"
+    assert commit["date_ts"] == 1704161045
+    assert commit["files"] == ["src/app.py", "img.png"]
+    assert commit["stats"] == {"insertions": 3, "deletions": 1, "files_changed": 2}
+    
+    # A commit without numstat entries changed no files
+    commit = _parse_log_record(b"def456\x1fA B\x1fa@b.c\x1f2024-01-02T03:04:05+01:00\x1f1704161045\x1fInitial\x1f")
+    assert commit["files"] == []
+    assert commit["stats"] == {"insertions": 0, "deletions": 0, "files_changed": 0}
+    print("✓ Git log parsing works")
+
+def test_shallow_clone_boundary():
+    print("\nTesting shallow clone boundary...")
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source")
+        git = ["git", "-C", source, "-c", "user.name=A B", "-c", "user.email=a@b.c"]
+        subprocess.run(["git", "init", "-q", source], check=True)
+        for i in range(4):
+            with open(os.path.join(source, f"file{i}.txt"), "w") as f:
+                f.write(f"{i}\n")
+            subprocess.run(git + ["add", "."], check=True)
+            subprocess.run(git + ["commit", "-q", "-m", f"Commit {i}"], check=True)
+        
+        clone = os.path.join(tmp, "clone.git")
+        subprocess.run(["git", "clone", "-q", "--bare", "--depth=2", f"file://{source}", clone], check=True)
+        
+        commits = list(GitAnalyzer(cache_dir=tmp)._iter_commits(clone, 10))
+        assert [c["message"] for c in commits] == ["Commit 3", "Commit 2"]
+        assert commits[0]["files"] == ["file3.txt"]
+        # The grafted boundary commit is not diffed against the empty tree
+        assert commits[1]["files"] == []
+        assert commits[1]["stats"]["files_changed"] == 0
+    print("✓ Shallow clone boundary commits list no files")
+
+class FakeOpenAI:
+    """Embeds paraphrases of "what changed" identically and streams a fixed chat reply"""
+    def __init__(self, reply):
+        self.reply = reply
+        self.chat_calls = 0
+        self.embeddings = SimpleNamespace(create=self._embed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+    
+    async def _embed(self, model, input):
+        vectors = [[1.0, 0.0] if "what changed" in text.lower() else [0.0, 1.0] for text in input]
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=v) for i, v in enumerate(vectors)])
+    
+    async def _chat(self, **kwargs):
+        self.chat_calls += 1
+        
+        async def chunks():
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.reply))])
+        return chunks()
+
+def test_semantic_query_cache():
+    print("\nTesting semantic query cache...")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "test.db"))
+        analyzer = LLMAnalyzer(db)
+        commits = [{"hash": "a1", "message": "Add parser", "category": "feature", "files": ["parser.py"], "impact": "low"}]
+        
+        async def ask(repo_id, query, reply):
+            analyzer.openai_client = FakeOpenAI(reply)
+            result = await analyzer.process_query(query, commits, {}, repo_id)
+            return result, analyzer.openai_client.chat_calls
+        
+        try:
+            # Miss: the answer is generated and cached
+            result, calls = asyncio.run(ask("repo", "What changed?", '{"answer": "A parser"}'))
+            assert result["answer"] == "A parser" and calls == 1
+            
+            # Hit: a paraphrase is answered from the cache without a chat call
+            result, calls = asyncio.run(ask("repo", "what changed recently", '{"answer": "Other"}'))
+            assert result["answer"] == "A parser" and calls == 0
+            
+            # Skip: a reply that is not JSON is returned but never cached
+            result, calls = asyncio.run(ask("other", "Tell me what changed", "Not JSON"))
+            assert result["answer"] == "Not JSON" and calls == 1
+            assert db.find_cached_query("other", np.array([1.0, 0.0]), 0.92) is None
+            
+            # Nor is it replayed for the identical question
+            result, calls = asyncio.run(ask("other", "Tell me what changed", '{"answer": "A parser"}'))
+            assert result["answer"] == "A parser" and calls == 1
+        finally:
+            db.close()
+    print("✓ Semantic query cache works")
+
 if __name__ == "__main__":
     test_git_analyzer()
-    test_database()
\ No newline at end of file
+    test_database()
+    test_parse_log_record()
+    test_shallow_clone_boundary()
+    test_semantic_query_cache()
\ No newline at end of file